@@ -101,6 +101,7 @@ def test_authenticate_to_roles(status_code, monkeypatch):
     mock_response = Mock()
     mock_response.status_code = status_code
     mock_response.text = "response"
+    mock_response.content = b"response"
 
     # Use monkeypatch to replace the HTTP_client.get method with the mock
     monkeypatch.setattr(http_client.HTTP_client, "get", lambda *args, **kwargs: mock_response)
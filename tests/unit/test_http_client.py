@@ -53,6 +53,12 @@ def test_init(client):
     expected_user_agent = f"{__title__}/{__version__}"
     assert str(expected_user_agent) in str(client.session.headers["User-Agent"])
 
+    # Check that connections are pooled, and failed requests are retried with a backoff
+    adapter = client.session.get_adapter("https://acme.okta.com")
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 256
+    assert adapter.max_retries.total == 3
+    assert adapter.max_retries.backoff_factor == 0.3
+
 
 def test_add_cookies(client):
     """Test setting cookies in the session."""
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 """Unit tests, and local fixtures for the Okta module."""
 from unittest.mock import Mock
-from unittest.mock import patch
 
 import pytest
 import requests.cookies
@@ -183,15 +182,43 @@ def test_mfa_index(preset_mfa, output, mocker, sample_json_response):
     primary_auth = sample_json_response["okta_response_mfa"]
 
     mfa_options = primary_auth["_embedded"]["factors"]
-    available_mfas = [f"{d['provider']}_{d['factorType']}_{d['id']}" for d in mfa_options]
     mocker.patch("tokendito.user.select_preferred_mfa_index", return_value=1)
 
     if preset_mfa == "pytest_dupe":
         with pytest.raises(SystemExit) as err:
-            mfa_index(preset_mfa, available_mfas, mfa_options)
+            mfa_index(preset_mfa, mfa_options)
         assert err.value.code == output
     else:
-        assert mfa_index(preset_mfa, available_mfas, mfa_options) == output
+        assert mfa_index(preset_mfa, mfa_options) == output
+
+
+def test_mfa_index_exact_match():
+    """Test that a full MFA id is preferred over substring matches."""
+    from tokendito.okta import mfa_index
+
+    mfa_options = [
+        {"provider": "OKTA", "factorType": "push", "id": "pytest"},
+        {"provider": "OKTA", "factorType": "push", "id": "pytest2"},
+    ]
+    assert mfa_index("OKTA_push_pytest", mfa_options) == 0
+    assert mfa_index("OKTA_push_pytest2", mfa_options) == 1
+
+
+def test_mfa_index_not_unique(caplog, monkeypatch):
+    """Test that an ambiguous preset lists every MFA id in the error."""
+    from tokendito import user
+    from tokendito.okta import mfa_index
+
+    # Values masked by earlier tests would otherwise hide parts of the MFA ids.
+    monkeypatch.setattr(user, "mask_items", [])
+    mfa_options = [
+        {"provider": "OKTA", "factorType": "push", "id": "pytest1"},
+        {"provider": "OKTA", "factorType": "push", "id": "pytest2"},
+    ]
+    with pytest.raises(SystemExit) as err:
+        mfa_index("OKTA_push", mfa_options)
+    assert err.value.code == 1
+    assert "['OKTA_push_pytest1', 'OKTA_push_pytest2']" in caplog.text
 
 
 def test_mfa_options(sample_headers, sample_json_response, mocker):
@@ -298,6 +325,37 @@ def test_push_approval(mocker, return_value, side_effect, expected):
         assert err.value.code == expected
 
 
+@pytest.mark.parametrize(
+    "response,expected",
+    [
+        ({"_embedded": {"factor": {"_embedded": {"challenge": {"correctAnswer": 42}}}}}, True),
+        ({"_embedded": {"factor": {"_embedded": None}}}, False),
+        ({"status": "MFA_CHALLENGE"}, False),
+    ],
+)
+def test_display_number_challenge(mocker, response, expected):
+    """Test displaying the Number Challenge from a push response."""
+    from tokendito import okta
+
+    mock_print = mocker.patch("tokendito.user.print")
+    assert okta.display_number_challenge(response) == expected
+    assert mock_print.called == expected
+
+
+def test_push_approval_backoff(mocker):
+    """Test that push polling backs off, and does not sleep after the last poll."""
+    from tokendito import okta
+
+    waiting = {"status": "MFA_CHALLENGE", "factorResult": "WAITING"}
+    success = {"status": "SUCCESS", "sessionToken": "pytest"}
+    mocker.patch.object(HTTP_client, "post", side_effect=[waiting] * 8 + [success])
+    sleep = mocker.patch("time.sleep", return_value=None)
+
+    assert okta.push_approval("https://pytest/verify", {}) == success
+    intervals = [call[0][0] for call in sleep.call_args_list]
+    assert intervals == [0.25, 0.375, 0.5625, 0.84375, 1.265625, 1.8984375, 2.0, 2.0]
+
+
 @pytest.mark.parametrize(
     "auth_properties,expected",
     [
@@ -346,6 +404,12 @@ def test_is_saml2_authentication(auth_properties, expected):
             True,
             "PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4=",
         ),
+        (
+            '<html><body><input name="SAMLResponse" type="hidden" '
+            'value="PD94bWwgdmVyc2lvbj0iMS4wIiBl\nbmNvZGluZz0iVVRGLTgiPz4="></body></html>',
+            False,
+            '<?xml version="1.0" encoding="UTF-8"?>',
+        ),
         (
             "",
             False,
@@ -356,6 +420,11 @@ def test_is_saml2_authentication(auth_properties, expected):
             False,
             None,
         ),
+        (
+            '<input name="SAMLResponse" type="hidden" value="not base64!">',
+            True,
+            "not base64!",
+        ),
     ],
 )
 def test_extract_saml_response(html, raw, expected):
@@ -436,17 +505,162 @@ def test_extract_saml_relaystate(html, expected):
     assert okta.extract_saml_relaystate(html) == expected
 
 
+@pytest.mark.parametrize(
+    "html,expected",
+    [
+        (
+            "<input type='hidden' value='https&#x3a;&#x2f;&#x2f;acme.com' name='RelayState'>",
+            "https://acme.com",
+        ),
+        ('<INPUT NAME="RelayState" VALUE="foo&amp;bar">', "foo&bar"),
+        (b"<input name='RelayState' value='caf\xc3\xa9'>", "caf\u00e9"),
+        ("<input name='RelayState'>", None),
+        ("<input name=RelayState value=foobar>", None),
+        ("invalid html", None),
+    ],
+)
+def test_scan_saml_form_attributes(html, expected):
+    """Test scanning for tag attributes without parsing the document."""
+    from tokendito import okta
+
+    assert okta.scan_saml_form(okta.get_raw_html(html), "SAMLResponse")[2] == expected
+
+
+def test_get_html_tree():
+    """Test parsing documents for XPath queries."""
+    from tokendito import okta
+
+    html = "<html><body><form id='appForm' action='/sso'></form></body></html>"
+    assert okta.find_tag_attribute(okta.get_html_tree(html), okta._form_action_xpath, id="appForm")
+    assert okta.get_html_tree(html.encode("utf-8")).xpath("//form/@action") == ["/sso"]
+    assert okta.get_html_tree("") is None
+    assert okta.find_tag_attribute(None, okta._form_action_xpath, id="appForm") is None
+
+
+def test_extract_saml_relaystate_fallback():
+    """Test that attributes the scanner cannot read are parsed from the document."""
+    from tokendito import okta
+
+    html = "<html><body><input name=RelayState type=hidden value=foobar></body></html>"
+    assert okta.extract_saml_relaystate(html) == "foobar"
+
+    html = "<html><body><input name=RelayState type=hidden value=café></body></html>"
+    assert okta.extract_saml_relaystate(html) == "café"
+    assert okta.extract_saml_relaystate(html.encode("utf-8")) == "café"
+
+
+def test_scan_saml_form():
+    """Test scanning a SAML form, keeping the first value of each field."""
+    from tokendito import okta
+
+    html = (
+        b"<FORM ID='appForm' ACTION='https://acme.org/sso?a=1&amp;b=2'>"
+        b'<input name="RelayState" value="foo"><input name="RelayState" value="bar">'
+        b'<input type="hidden" name="SAMLResponse"></form>'
+    )
+    expected = (None, "https://acme.org/sso?a=1&b=2", "foo")
+    assert okta.scan_saml_form(html, "SAMLResponse") == expected
+
+    # Tags inside comments and scripts are not part of the document.
+    html = (
+        b'<!-- <form id="appForm" action="https://evil/"> -->'
+        b'<script>var f = \'<input name="RelayState" value="evil">\';</script>'
+        b'<form id="appForm" action="https://good/"><input name="RelayState" value="good">'
+        b'<input name="SAMLResponse" value="cmVzcG9uc2U="></form><!-- unterminated <input'
+    )
+    expected = ("cmVzcG9uc2U=", "https://good/", "good")
+    assert okta.scan_saml_form(html, "SAMLResponse") == expected
+
+
+@pytest.mark.parametrize(
+    "html,saml_field,expected",
+    [
+        (
+            b'<form id="appForm" action="https://acme.org/sso">'
+            b'<input name="SAMLResponse" type="hidden" value="cmVzcG9uc2U="/>'
+            b'<input name="RelayState" type="hidden" value="foobar"/></form>',
+            "SAMLResponse",
+            ("cmVzcG9uc2U=", "https://acme.org/sso", "foobar"),
+        ),
+        (
+            "<form id=appForm action=https://acme.org/sso>"
+            "<input name=SAMLRequest type=hidden value=cmVxdWVzdA==></form>",
+            "SAMLRequest",
+            ("cmVxdWVzdA==", "https://acme.org/sso", None),
+        ),
+        (
+            "<form id=appForm action=https://acme.org/café>"
+            '<input name="SAMLResponse" value="cmVzcG9uc2U="></form>'.encode("utf-8"),
+            "SAMLResponse",
+            ("cmVzcG9uc2U=", "https://acme.org/café", None),
+        ),
+        ("invalid html", "SAMLResponse", (None, None, None)),
+    ],
+)
+def test_extract_saml_form(mocker, html, saml_field, expected):
+    """Test extracting all SAML form fields, parsing the document at most once."""
+    from tokendito import okta
+
+    get_html_tree = mocker.spy(okta, "get_html_tree")
+    assert okta.extract_saml_form(html, saml_field) == expected
+    assert get_html_tree.call_count == (0 if None not in expected else 1)
+
+
+def test_extract_saml_form_fields(mocker):
+    """Test that the document is only parsed for missing fields the caller needs."""
+    from tokendito import okta
+
+    html = b'<form id="appForm" action="https://acme.org/sso"><input name=SAMLRequest value=x>'
+    get_html_tree = mocker.spy(okta, "get_html_tree")
+
+    assert okta.extract_form_post_url(html) == "https://acme.org/sso"
+    assert okta.extract_saml_relaystate(html) is None
+    assert get_html_tree.call_count == 1
+    assert okta.extract_saml_request(html, raw=True) == "x"
+    assert get_html_tree.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "html,expected",
+    [
+        (
+            "<html><script>var stateToken = '00abc\\x2Ddef';</script></html>",
+            "00abc-def",
+        ),
+        ("<html><script>var stateToken='00abc';</script></html>", "00abc"),
+        ("<script>var stateToken = '00abc';var foo = 'bar';</script>", "00abc"),
+        ("<html><script>var foo = 'bar';</script></html>", None),
+        ("invalid html", None),
+    ],
+)
+def test_extract_state_token(html, expected):
+    """Test extracting the state token."""
+    from tokendito import okta
+
+    assert okta.extract_state_token(html) == expected
+    assert okta.extract_state_token(html.encode("utf-8")) == expected
+
+
+def test_extract_state_token_invalid_utf8():
+    """Test that a state token with bytes that are not UTF-8 does not raise."""
+    from tokendito import okta
+
+    assert okta.extract_state_token(b"<script>var stateToken = '00\xffabc';</script>") == (
+        "00\ufffdabc"
+    )
+
+
 def test_get_saml_request(mocker):
     """Test getting SAML request."""
     from tokendito import okta
     from tokendito.http_client import HTTP_client
 
     mock_response = Mock()
-    mock_response.text = (
-        "<html><body><form action='https://acme.okta.com/app/okta_org2org/akjlkjlksjx0xmdd/sso/"
-        "saml' id='appForm' method='POST'</form><input name='SAMLRequest' type='hidden' "
-        "value='PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4='>"
-        "<input name='RelayState' type='hidden' value='foobar'></body></html>"
+    mock_response.content = (
+        b"<html><body><form action='https://acme.okta.com/app/okta_org2org/akjlkjlksjx0xmdd/sso/"
+        b"saml' id='appForm' method='POST'</form><input name='SAMLRequest' type='hidden' "
+        b"value='PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4='>"
+        b"<input name='RelayState' type='hidden' value='foobar'></body></html>"
     )
 
     mocker.patch.object(HTTP_client, "get", return_value=mock_response)
@@ -464,19 +678,17 @@ def test_get_saml_request(mocker):
 def test_send_saml_request(mocker):
     """Test sending SAML request."""
     from tokendito import okta
-    import base64
 
     mock_response = Mock()
-    mock_response.text = (
-        "<html><body><form action='https://acme.okta.com/app/okta_org2org/akjlkjlksjx0xmdd/sso/"
-        "saml' id='appForm' method='POST'</form><input name='SAMLResponse' type='hidden' "
-        "value='PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4='>"
-        "<input name='RelayState' type='hidden' value='foobar'></body></html>"
+    mock_response.content = (
+        b"<html><body><form action='https://acme.okta.com/app/okta_org2org/akjlkjlksjx0xmdd/sso/"
+        b"saml' id='appForm' method='POST'</form><input name='SAMLResponse' type='hidden' "
+        b"value='PD94bWwgdmVyc2lvbj0iMS4wIiBlbmNvZGluZz0iVVRGLTgiPz4='>"
+        b"<input name='RelayState' type='hidden' value='foobar'></body></html>"
     )
 
     saml_request = {"relay_state": "relay_state", "request": "request", "post_url": "post_url"}
 
-    mocker.patch.object(base64, "b64decode", return_value="foo")
     mocker.patch("tokendito.http_client.HTTP_client.get", return_value=mock_response)
 
     assert okta.send_saml_request(saml_request) == {
@@ -499,6 +711,8 @@ def test_send_saml_response(mocker):
     mock_response.status_code = 201
     mock_response.session = Mock()
     mock_response.session.cookies = cookies
+    mock_response.cookies = cookies
+    mock_response.history = []
 
     saml_response = {
         "response": "pytestresponse",
@@ -516,20 +730,71 @@ def test_send_saml_response(mocker):
 
     assert okta.send_saml_response(pytest_config, saml_response) is None
 
+    # An idx cookie left in the session by an earlier step does not skip the token redirect.
+    pytest_config = Config(okta={"org": "https://acme.okta.com"})
+    mocker.patch("tokendito.okta.extract_state_token", return_value="pyteststatetoken")
+    redirect_response = Mock(cookies={"idx": "pytestidx"})
+    patched_get = mocker.patch.object(HTTP_client, "get", return_value=redirect_response)
+    mocker.patch.object(HTTP_client.session, "cookies", requests.cookies.RequestsCookieJar())
+    HTTP_client.session.cookies.set("idx", "pytestidx", domain="acme.okta.com", path="/")
+    assert okta.send_saml_response(pytest_config, saml_response) is None
+    assert patched_get.call_count == 1
+
+    # With an idx cookie set by a redirect of the SAML POST, the token redirect is skipped.
+    patched_get.reset_mock()
+    redirect_cookies = requests.cookies.RequestsCookieJar()
+    redirect_cookies.set("idx", "pytestidx", domain=".acme.okta.com", path="/")
+    mock_response.history = [Mock(cookies=redirect_cookies)]
+    assert okta.send_saml_response(pytest_config, saml_response) is None
+    assert patched_get.call_count == 0
+
+
+@pytest.mark.parametrize(
+    "domain,domain_specified,url,expected",
+    [
+        ("acme.okta.com", False, "https://acme.okta.com", True),
+        ("acme.okta.com", False, "https://acme.okta.com:443", True),
+        (".acme.okta.com", True, "https://acme.okta.com", True),
+        (".okta.com", True, "https://acme.okta.com", True),
+        ("okta.com", True, "https://acme.okta.com", True),
+        ("okta.com", False, "https://acme.okta.com", False),
+        ("other.okta.com", False, "https://acme.okta.com", False),
+        ("cme.okta.com", True, "https://acme.okta.com", False),
+    ],
+)
+def test_has_session_cookie(domain, domain_specified, url, expected):
+    """Test matching response cookies to the org host, including domain cookies."""
+    from tokendito import okta
+
+    cookie = requests.cookies.create_cookie("idx", "pytestidx", domain=domain, path="/")
+    cookie.domain_specified = domain_specified
+    cookies = requests.cookies.RequestsCookieJar()
+    cookies.set_cookie(cookie)
+    response = Mock(cookies=cookies, history=[])
+
+    assert okta.has_session_cookie(response, "idx", url) is expected
+    assert okta.has_session_cookie(response, "sid", url) is False
+
 
 def test_get_auth_pipeline(mocker):
     """Test get_auth_pipeline."""
     from tokendito import okta
 
+    okta.get_auth_pipeline.cache_clear()
     mock_response = Mock()
     mock_response.json.return_value = {"pipeline": "idx"}
-    mocker.patch.object(HTTP_client, "get", return_value=mock_response)
+    patched_get = mocker.patch.object(HTTP_client, "get", return_value=mock_response)
+    assert okta.get_auth_pipeline() == "idx"
+    # The result is cached, so a second lookup does not call the org again.
     assert okta.get_auth_pipeline() == "idx"
+    assert patched_get.call_count == 1
 
+    okta.get_auth_pipeline.cache_clear()
     mock_response.json.return_value = {"pipeline": "v1"}
     mocker.patch.object(HTTP_client, "get", return_value=mock_response)
     assert okta.get_auth_pipeline() == "v1"
 
+    okta.get_auth_pipeline.cache_clear()
     mocker.patch.object(HTTP_client, "get", return_value="invalid format")
     with pytest.raises(SystemExit) as error:
         assert okta.get_auth_pipeline() == error
@@ -540,6 +805,26 @@ def test_get_auth_pipeline(mocker):
         assert okta.get_auth_pipeline() == error
 
 
+def test_get_auth_properties(mocker):
+    """Test get_auth_properties."""
+    from tokendito import okta
+
+    okta.get_auth_properties.cache_clear()
+    mock_response = Mock()
+    mock_response.json.return_value = {
+        "links": [{"properties": {"okta:idp:type": "OKTA", "okta:idp:id": "pytest"}}]
+    }
+    patched_get = mocker.patch.object(HTTP_client, "get", return_value=mock_response)
+    expected = {"metadata": None, "type": "OKTA", "id": "pytest"}
+    assert okta.get_auth_properties(userid="pytest", url="https://acme.okta.org") == expected
+    assert okta.get_auth_properties(userid="pytest", url="https://acme.okta.org") == expected
+    assert patched_get.call_count == 1
+
+    mock_response.json.return_value = {}
+    with pytest.raises(SystemExit) as error:
+        assert okta.get_auth_properties(userid="other", url="https://acme.okta.org") == error
+
+
 def test_create_authz_cookies():
     """Test create_authz_cookies."""
     from tokendito import okta
@@ -608,22 +893,26 @@ def test_get_pkce_code_challenge():
     )
 
 
-@patch("hashlib.sha256")
-def test_get_oauth2_state(mocker):
+def test_get_oauth2_state():
     """Test getting OAuth2 state."""
+    import re
+
     from tokendito import okta
 
-    mocker.return_value.hexdigest.return_value = "random_digested"
-    assert okta.get_oauth2_state() == "random_digested"
+    state = okta.get_oauth2_state()
+    assert re.fullmatch(r"[0-9a-f]{64}", state)
+    assert state != okta.get_oauth2_state()
 
 
-@patch("base64.urlsafe_b64encode")
-def test_get_pkce_code_verifier(mocker):
+def test_get_pkce_code_verifier():
     """Test get_pkce_code_verifier."""
+    import re
+
     from tokendito import okta
 
-    mocker.return_value.decode.return_value = "@#!decoded_value%%"
-    assert okta.get_pkce_code_verifier() == "decodedvalue"
+    code_verifier = okta.get_pkce_code_verifier()
+    assert re.fullmatch(r"[A-Za-z0-9\-._~]{43,128}", code_verifier)
+    assert code_verifier != okta.get_pkce_code_verifier()
 
 
 def test_pkce_enabled():
@@ -644,6 +933,13 @@ def test_get_authorize_code():
     response.url = "https//example.com?error=login_required"
     assert okta.get_authorize_code(response, None) is None
 
+    response.url = "https://example.com?state=pytest"
+    assert okta.get_authorize_code(response, "sessionToken") is None
+
+    response.url = "https://example.com?error=access_denied&error_description=Denied%20by+policy"
+    with pytest.raises(SystemExit) as error:
+        assert okta.get_authorize_code(response, "sessionToken") == error
+
 
 def test_authorization_code_enabled():
     """Test authorization_code_enabled."""
@@ -692,6 +988,8 @@ def test_authorize_request(mocker):
         "authorization_endpoint": "pytestauthurl",
     }
     assert okta.authorize_request(pytest_oauth2_config, pytest_oauth2_session_data) == "pytest"
+    # The /authorize call is a GET, so it has no body and no content type.
+    assert "content-type" not in HTTP_client.get.call_args[1]["headers"]
 
 
 def test_get_nonce(mocker):
@@ -740,11 +1038,15 @@ def test_get_oauth2_configuration(mocker):
     pytest_config = Config(
         okta={"client_id": "test_client_id", "org": "acme", "username": "pytest"}
     )
+    okta.get_authorization_server_metadata.cache_clear()
     mocker.patch.object(HTTP_client, "get", return_value=response)
     assert okta.get_oauth2_configuration(pytest_config)["org"] == "acme"
+    # The cached server metadata is not modified by the configuration we build on top of it.
+    assert "org" not in okta.get_authorization_server_metadata("acme")
+    assert response.json.call_count == 1
 
 
-def test_validate_oauth2_configuration():
+def test_validate_oauth2_configuration(caplog):
     """Test validate_oauth2_configuration."""
     from tokendito import okta
 
@@ -760,6 +1062,8 @@ def test_validate_oauth2_configuration():
 
     with pytest.raises(SystemExit) as error:
         assert okta.validate_oauth2_configuration(pytest_oauth2_config) == error
+    # Every missing item is reported at once.
+    assert "No authorization_endpoint, ln found in oauth2 configuration." in caplog.text
 
     pytest_oauth2_config = {
         "client_id": "123",
@@ -874,6 +1178,16 @@ def test_oie_enabled(mocker):
     mocker.patch("tokendito.okta.get_auth_pipeline", return_value="foobar")
     assert okta.oie_enabled("pytesturl") is False
 
+    # Repeated checks reuse the pipeline metadata already fetched for the org.
+    mocker.stopall()
+    okta.get_auth_pipeline.cache_clear()
+    mock_response = Mock()
+    mock_response.json.return_value = {"pipeline": "idx"}
+    patched_get = mocker.patch.object(HTTP_client, "get", return_value=mock_response)
+    assert okta.oie_enabled("pytesturl") is True
+    assert okta.oie_enabled("pytesturl") is True
+    assert patched_get.call_count == 1
+
 
 def test_get_redirect_uri():
     """Test getting redirect URI."""
@@ -909,9 +1223,11 @@ def test_access_control(mocker):
         }
     )
     mocker.patch("tokendito.okta.oie_enabled", return_value=False)
-    mocker.patch("tokendito.okta.idp_authenticate", return_value=None)
+    mocker.patch("tokendito.okta.get_auth_properties", return_value={"type": "OKTA"})
+    patched_idp_authenticate = mocker.patch("tokendito.okta.idp_authenticate", return_value=None)
     mocker.patch("tokendito.okta.idp_authorize", return_value=None)
     assert okta.access_control(pytest_config) is None
+    patched_idp_authenticate.assert_called_once_with(pytest_config, {"type": "OKTA"})
 
     mocker.patch("tokendito.okta.oie_enabled", return_value=True)
     mocker.patch("tokendito.okta.get_oauth2_configuration", return_value=None)
@@ -953,6 +1269,8 @@ def test_idp_authenticate(mocker):
     with pytest.raises(SystemExit) as error:
         assert okta.idp_authenticate(pytest_config) == error
 
+    assert okta.idp_authenticate(pytest_config, {"type": "OKTA"}) is None
+
 
 def test_step_up_authenticate(mocker):
     """Test set up authenticate method."""
@@ -1026,6 +1344,12 @@ def test_local_authenticate(mocker):
 
     assert okta.local_authenticate(pytest_config) == "pytesttoken"
 
+    # A missing session token is an error, and is not retried.
+    patched_get_session_token = mocker.patch("tokendito.okta.get_session_token", return_value=None)
+    with pytest.raises(SystemExit) as error:
+        assert okta.local_authenticate(pytest_config) == error
+    assert patched_get_session_token.call_count == 1
+
 
 def test_saml2_authenticate(mocker):
     """Test saml2 authentication."""
@@ -1054,5 +1378,11 @@ def test_saml2_authenticate(mocker):
 
     mocker.patch("tokendito.okta.send_saml_request", return_value=saml_response)
     mocker.patch("tokendito.okta.send_saml_response", return_value=None)
-    mocker.patch("tokendito.okta.idp_authenticate", return_value=None)
+    patched_idp_authenticate = mocker.patch("tokendito.okta.idp_authenticate", return_value=None)
     assert okta.saml2_authenticate(pytest_config, auth_properties) is None
+
+    # The chained IdP is authenticated with its own org, and our config is left untouched.
+    saml2_config = patched_idp_authenticate.call_args[0][0]
+    assert saml2_config.okta["org"] == "https://acme.okta.com"
+    assert saml2_config.okta["username"] == "pytest"
+    assert pytest_config.okta["org"] == "https://acme.okta.org/"
@@ -321,10 +321,24 @@ def test_logger_mask(caplog):
         logger.debug("This should be displayed, but not: supersecret")
         logger.debug("another secret")
         logger.debug(secret_dict)
+        logger.debug("Formatted %s and %s", "supersecret", secret_dict)
     assert "supersecret" not in caplog.text
     assert "another secret" not in caplog.text
     assert "secret_val" not in caplog.text
     assert "This should be displayed" in caplog.text
+    assert "Formatted ***** and" in caplog.text
+
+
+def test_logger_mask_bad_format():
+    """Test that a format mismatch does not raise out of the masking filter."""
+    import logging
+
+    from tokendito import user
+
+    record = logging.LogRecord(__name__, logging.DEBUG, __file__, 0, "bad %s %s", (1,), None)
+    assert user.MaskLoggerSecret().filter(record) is True
+    assert record.msg == "bad %s %s"
+    assert record.args == (1,)
 
 
 def test_display_selected_role():
@@ -67,11 +67,11 @@ def authenticate_to_roles(config, urls):
         params = {"token": token, "redirectUrl": url}
         response = HTTP_client.get(session_url, params=params)
 
-        saml_response_string = response.text
-
-        saml_xml = okta.extract_saml_response(saml_response_string)
+        # The extractors scan the raw body, so the page is only decoded where the text is needed.
+        saml_xml = okta.extract_saml_response(response.content)
         if not saml_xml:
-            state_token = okta.extract_state_token(saml_response_string)
+            state_token = okta.extract_state_token(response.content)
+            saml_response_string = response.text
             if state_token:
                 logger.info(f"Step-Up authentication required for {url}.")
                 if okta.step_up_authenticate(config, state_token):
@@ -87,7 +87,7 @@ def authenticate_to_roles(config, urls):
                 logger.error("Invalid data detected in SAML response. Aborting.")
             logger.debug(saml_response_string)
             sys.exit(1)
-        responses.append((url, saml_response_string, saml_xml, label))
+        responses.append((url, response.text, saml_xml, label))
 
     return responses[0] if tile_count == 1 else responses
 
@@ -96,11 +96,11 @@ def get_devices(duo_auth):
     :param duo_auth: contains html content listing available factors.
     :return factor_options: list of dict objects describing each MFA option.
     """
-    soup = BeautifulSoup(duo_auth.content, "html.parser")
+    soup = BeautifulSoup(duo_auth.content, "lxml")
     devices = []
 
     device_soup = soup.find("select", {"name": "device"})
-    if type(device_soup) is bs4.element.Tag:
+    if isinstance(device_soup, bs4.Tag):
         options = device_soup.findAll("option")
         devices = [f"{d['value']} - {d.text}" for d in options]
     if not devices:
@@ -111,7 +111,7 @@ def get_devices(duo_auth):
     factors = []
     for device in devices:
         options = soup.find("fieldset", {"data-device-index": device.split(" - ")[0]})
-        if type(options) is bs4.element.Tag:
+        if isinstance(options, bs4.Tag):
             factors = options.findAll("input", {"name": "factor"})
         for factor in factors:
             factor_option = {"device": device, "factor": factor["value"]}
@@ -46,7 +46,14 @@ class HTTPClient:
         """Initialize the HTTPClient with a session object."""
         user_agent = generate_user_agent()
         self.session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(pool_maxsize=256)
+        # A single pooled session keeps TLS connections to the Okta org alive across the
+        # sequential calls of an authentication flow. Connection errors are retried for every
+        # method, read errors only for idempotent ones.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=256,
+            max_retries=requests.adapters.Retry(total=3, backoff_factor=0.3),
+        )
         self.session.mount("https://", adapter)
         self.session.headers.update({"User-Agent": user_agent})
 
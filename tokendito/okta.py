@@ -9,18 +9,23 @@ Handle the all Okta operations.
 """
 import base64
 import codecs
-from copy import deepcopy
+import concurrent.futures
+from copy import copy
+import functools
 import hashlib
+from html import unescape
 import json
 import logging
-import os
 import re
+import secrets
 import sys
 import time
 import urllib
 
 import bs4
 from bs4 import BeautifulSoup
+from lxml import etree
+import lxml.html
 import requests.cookies
 from tokendito import duo
 from tokendito import user
@@ -35,6 +40,33 @@ _status_dict = dict(
     LOCKED_OUT="Your account is locked out",
 )
 
+# The authorization server must have these config elements.
+_mandatory_oauth2_config_items = frozenset(
+    {
+        "authorization_endpoint",
+        "token_endpoint",
+        "grant_types_supported",
+        "response_types_supported",
+        "scopes_supported",
+        "client_id",
+        "org",
+        "ln",
+    }
+)
+
+# Patterns used to pull single fields out of Okta HTML pages without a full parse. Pages
+# are scanned as raw bytes, and only the matched tags are decoded.
+# Comments and script bodies are matched first, so that tags inside them are skipped.
+_form_field_tag_pattern = re.compile(
+    rb"<!--.*?(?:-->|\Z)|<script\b.*?(?:</script\s*>|\Z)|<(form|input)\b[^>]*>",
+    re.IGNORECASE | re.DOTALL,
+)
+_tag_attribute_pattern = re.compile(r"""([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_state_token_pattern = re.compile(rb"var stateToken\s*=\s*'(?P<stateToken>.*?)';", re.MULTILINE)
+# XPath queries used when a document cannot be scanned, and must be parsed.
+_input_value_xpath = etree.XPath("//input[@name=$name]/@value")
+_form_action_xpath = etree.XPath("//form[@id=$id]/@action")
+
 
 def api_error_code_parser(status=None):
     """Status code parsing.
@@ -42,17 +74,21 @@ def api_error_code_parser(status=None):
     param status: Response status
     return message: status message
     """
-    if status and status in _status_dict.keys():
+    if status in _status_dict:
         message = f"Okta auth failed: {_status_dict[status]}"
     else:
         message = f"Okta auth failed: {status}. Please verify your settings and try again."
-    logger.debug(f"Parsing error [{message}] ")
+    logger.debug("Parsing error [%s] ", message)
     return message
 
 
+@functools.lru_cache(maxsize=32)
 def get_auth_pipeline(url=None):
-    """Get auth pipeline version."""
-    logger.debug(f"get_auth_pipeline({url})")
+    """Get auth pipeline version.
+
+    The result is cached per org URL for the lifetime of the process.
+    """
+    logger.debug("get_auth_pipeline(%s)", url)
     headers = {"accept": "application/json"}
     url = f"{url}/.well-known/okta-organization"
 
@@ -71,13 +107,17 @@ def get_auth_pipeline(url=None):
     if auth_pipeline != "idx" and auth_pipeline != "v1":
         logger.error(f"unsupported auth pipeline version {auth_pipeline}")
         sys.exit(1)
-    logger.debug(f"Pipeline is of type {auth_pipeline}")
+    logger.debug("Pipeline is of type %s", auth_pipeline)
     return auth_pipeline
 
 
+@functools.lru_cache(maxsize=32)
 def get_auth_properties(userid=None, url=None):
     """Make a call to the webfinger endpoint to get the auth properties metadata.
 
+    The result is cached per user and org URL for the lifetime of the process, and must
+    not be modified by callers.
+
     :param userid: User's ID for which we are requesting an auth endpoint.
     :param url: Okta organization URL where we are looking up the user.
     :returns: Dictionary containing authentication properties.
@@ -85,7 +125,7 @@ def get_auth_properties(userid=None, url=None):
     payload = {"resource": f"okta:acct:{userid}", "rel": "okta:idp"}
     headers = {"accept": "application/jrd+json"}
     url = f"{url}/.well-known/webfinger"
-    logger.debug(f"Looking up auth endpoint for {userid} in {url}")
+    logger.debug("Looking up auth endpoint for %s in %s", userid, url)
 
     # Make a GET request to the webfinger endpoint.
     response = HTTP_client.get(url, params=payload, headers=headers)
@@ -95,7 +135,7 @@ def get_auth_properties(userid=None, url=None):
         ret = response.json()["links"][0]["properties"]
     except (KeyError, ValueError) as e:
         logger.error(f"Failed to parse authentication type in {url}:{str(e)}")
-        logger.debug(f"Response: {response.text}")
+        logger.debug("Response: %s", response.text)
         sys.exit(1)
 
     # Extract specific authentication properties if available.
@@ -105,7 +145,7 @@ def get_auth_properties(userid=None, url=None):
     properties["type"] = ret.get("okta:idp:type", None)
     properties["id"] = ret.get("okta:idp:id", None)
 
-    logger.debug(f"Auth properties are {properties}")
+    logger.debug("Auth properties are %s", properties)
     return properties
 
 
@@ -123,25 +163,25 @@ def get_saml_request(auth_properties):
     base_url = user.get_base_url(auth_properties["metadata"])
     url = f"{base_url}/sso/idps/{auth_properties['id']}"
 
-    logger.debug(f"Getting SAML request from {url}")
+    logger.debug("Getting SAML request from %s", url)
 
     # Make a GET request using the HTTP client to retrieve the SAML request.
     response = HTTP_client.get(url, headers=headers)
 
-    # Extract the required parameters from the SAML request.
-    post_url = extract_form_post_url(response.text)
-    base_url = user.get_base_url(post_url)
+    # Extract the required parameters from the SAML request. The raw body is scanned, so we
+    # skip decoding the whole document.
+    saml_base64, post_url, relay_state = extract_saml_form(response.content, "SAMLRequest")
     saml_request = {
-        "base_url": base_url,
+        "base_url": user.get_base_url(post_url),
         "post_url": post_url,
-        "relay_state": extract_saml_relaystate(response.text),
-        "request": extract_saml_request(response.text, raw=True),
+        "relay_state": relay_state,
+        "request": saml_base64,
     }
 
     # Mask sensitive data in the logs for security.
     user.add_sensitive_value_to_be_masked(saml_request["request"])
 
-    logger.debug(f"SAML request is {saml_request}")
+    logger.debug("SAML request is %s", saml_request)
     return saml_request
 
 
@@ -158,31 +198,29 @@ def send_saml_request(saml_request):
         "SAMLRequest": saml_request["request"],
     }
 
-    headers = {
-        "accept": "text/html,application/xhtml+xml,application/xml",
-        "Content-Type": "application/json",
-    }
+    headers = {"accept": "text/html,application/xhtml+xml,application/xml"}
 
     # Construct the URL from the provided saml_request
     url = saml_request["post_url"]
 
     # Log the SAML request details
-    logger.debug(f"Sending SAML request to {url}")
+    logger.debug("Sending SAML request to %s", url)
 
     # Use the HTTP client to make a GET request
     response = HTTP_client.get(url, params=payload, headers=headers)
 
     # Extract relevant information from the response to form the saml_response dictionary
+    saml_base64, post_url, relay_state = extract_saml_form(response.content, "SAMLResponse")
     saml_response = {
-        "response": extract_saml_response(response.text, raw=True),
-        "relay_state": extract_saml_relaystate(response.text),
-        "post_url": extract_form_post_url(response.text),
+        "response": saml_base64,
+        "relay_state": relay_state,
+        "post_url": post_url,
     }
 
     # Mask sensitive values for logging purposes
     user.add_sensitive_value_to_be_masked(saml_response["response"])
 
-    logger.debug(f"SAML response is {saml_response}")
+    logger.debug("SAML response is %s", saml_response)
     # Return the formed SAML response
     return saml_response
 
@@ -259,7 +297,7 @@ def send_saml_response(config, saml_response):
     url = saml_response["post_url"]
 
     # Log the SAML response details.
-    logger.debug(f"Sending SAML response to {url}")
+    logger.debug("Sending SAML response to %s", url)
     # Use the HTTP client to make a POST request.
     response = HTTP_client.post(url, data=payload, headers=headers)
 
@@ -272,27 +310,56 @@ def send_saml_response(config, saml_response):
     else:
         logger.debug("We did not find a 'sid' entry in the cookies.")
 
+    # The token redirect below is only needed to obtain the idx session cookie, so we skip
+    # that round trip if this POST already set one for our org.
+    org = config.okta["org"]
+    if has_session_cookie(response, "idx", org):
+        logger.debug("Session cookie idx for %s was set by the SAML response.", org)
+        return
+
     # Extract the state token from the response.
-    state_token = extract_state_token(response.text)
+    state_token = extract_state_token(response.content)
     if state_token:  # TODO: this is not working yet.
         params = {"stateToken": state_token}
         headers = {
             "accept": "text/html,application/xhtml+xml,application/xml",
         }
         response = HTTP_client.get(
-            f"{config.okta['org']}/login/token/redirect",
+            f"{org}/login/token/redirect",
             params=params,
             headers=headers,
         )
         if "idx" not in response.cookies:
-            logger.error(
-                f"Session cookie idx for {config.okta['org']} not found. Please file a bug."
-            )
-            logger.debug(f"Response: {response.headers}")
-            logger.debug(f"Response: {response.text}")
+            logger.error(f"Session cookie idx for {org} not found. Please file a bug.")
+            logger.debug("Response: %s", response.headers)
+            logger.debug("Response: %s", response.text)
             sys.exit(2)
 
 
+def has_session_cookie(response, name, url):
+    """Check whether a response, or a redirect leading to it, set a cookie for a URL's host.
+
+    Cookies set with a Domain attribute are stored with a leading dot, so an exact domain
+    lookup would miss them.
+
+    :param response: response object
+    :param name: cookie name
+    :param url: URL whose host the cookie must apply to
+    :return: True if a matching cookie was set, False otherwise.
+    """
+    host = urllib.parse.urlparse(url).hostname or ""
+    cookies = [cookie for res in [*response.history, response] for cookie in res.cookies]
+    for cookie in cookies:
+        domain = cookie.domain.lstrip(".")
+        # Host-only cookies are sent to their exact host, domain cookies to subdomains too.
+        is_domain_cookie = cookie.domain_specified or cookie.domain.startswith(".")
+        if cookie.name != name:
+            continue
+        if host == domain or (is_domain_cookie and host.endswith(f".{domain}")):
+            return True
+    return False
+
+
 def get_session_token(config, primary_auth, headers):
     """Get session_token.
 
@@ -313,7 +380,7 @@ def get_session_token(config, primary_auth, headers):
         # Note: mfa_challenge should also be modified to accept and use http_client
         session_token = mfa_challenge(config, headers, primary_auth)
     else:
-        logger.debug(f"Error parsing response: {json.dumps(primary_auth)}")
+        logger.debug("Error parsing response: %s", primary_auth)
         logger.error(f"Okta auth failed: unknown status {status}")
         sys.exit(1)
 
@@ -355,7 +422,7 @@ def get_access_token(oauth2_config, oauth2_session_data, authorize_code):
     try:
         access_token = response["access_token"]
     except KeyError:
-        logger.debug(f"Error parsing response: {json.dumps(response)}")
+        logger.debug("Error parsing response: %s", response)
         # Don't do anything but a debug message, as the /token call doesnt seem to be needed.
     return access_token
 
@@ -369,11 +436,11 @@ def get_enduser_url(url):
     enduser_url = None
 
     res = HTTP_client.get(url)
-    soup = BeautifulSoup(res.text, "html.parser")
+    soup = BeautifulSoup(res.text, "lxml")
     pattern = re.compile(r".*enduser-v.*enduser.*")
     script = soup.find("script", src=pattern)
-    if type(script) is bs4.element.Tag:
-        logger.debug(f"Found script tag: {script['src']}")
+    if isinstance(script, bs4.Tag):
+        logger.debug("Found script tag: %s", script["src"])
         enduser_url = script["src"]
     return enduser_url
 
@@ -392,7 +459,7 @@ def get_client_id_by_url(url):
 
         match = pattern.search(res.text)
         if match:
-            logger.debug(f"Found clientId: {match.group('clientId')}")
+            logger.debug("Found clientId: %s", match.group("clientId"))
             client_id = match.group("clientId")
 
     return client_id
@@ -405,8 +472,9 @@ def get_client_id(config):
     If no command line parameter was passed, it will try to determine it.
 
     """
-    if "client_id" in config.okta and config.okta["client_id"]:
-        return config.okta["client_id"]
+    client_id = config.okta.get("client_id")
+    if client_id:
+        return client_id
     else:
         return get_client_id_by_url(config.okta["org"])
 
@@ -437,7 +505,7 @@ def get_authorize_scope():
 
 def get_oauth2_state():
     """Generate a random string for state."""
-    state = hashlib.sha256(os.urandom(1024)).hexdigest()
+    state = secrets.token_hex(32)
     return state
 
 
@@ -460,9 +528,8 @@ def get_pkce_code_challenge(code_verifier=None):
     :param: code_verifier
     :return: code_challenge
     """
-    code_challenge = hashlib.sha256(code_verifier.encode("utf-8")).digest()
-    code_challenge = base64.urlsafe_b64encode(code_challenge).decode("utf-8")
-    code_challenge = code_challenge.replace("=", "")
+    digest = hashlib.sha256(code_verifier.encode("utf-8")).digest()
+    code_challenge = base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
     return code_challenge
 
 
@@ -470,10 +537,12 @@ def get_pkce_code_verifier():
     """
     Get pkce code verifier.
 
+    The verifier is 86 characters long, within the 43 to 128 allowed by RFC 7636. The
+    URL-safe base64 alphabet is a subset of the allowed characters, so no filtering is needed.
+
     :return: code_verifier
     """
-    code_verifier = base64.urlsafe_b64encode(os.urandom(40)).decode("utf-8")
-    code_verifier = re.sub("[^a-zA-Z0-9]+", "", code_verifier)
+    code_verifier = secrets.token_urlsafe(64)
     return code_verifier
 
 
@@ -495,22 +564,19 @@ def get_authorize_code(response, session_token):
     It will also check the response from the /authorize call for callback errors,
     And if any, print and exit with error.
     """
-    callback_url = response.url
-    error_code = re.search(r"(?<=error=)[^&]+", callback_url)
-    error_desc = re.search(r"(?<=error_description=)[^&]+", callback_url)
-    if error_code:
-        error_value = error_code.group()
+    callback_params = urllib.parse.parse_qs(urllib.parse.urlparse(response.url).query)
+    error_value = callback_params.get("error", [None])[0]
+    if error_value:
         if not session_token and error_value == "login_required":
             return (
                 None  # if we arent authenticated we wont have sessionToken, so ignore login error.
             )
         else:
-            logger.error(f"Oauth2 callback error:{error_value}:{error_desc.group()}")
-            logger.debug(f"Response: {response.text}")
+            error_desc = callback_params.get("error_description", [None])[0]
+            logger.error(f"Oauth2 callback error:{error_value}:{error_desc}")
+            logger.debug("Response: %s", response.text)
             sys.exit(1)
-    authorize_code = re.search(r"(?<=code=)[^&]+", callback_url)
-    if authorize_code:
-        return authorize_code.group()
+    return callback_params.get("code", [None])[0]
 
 
 def authorization_code_enabled(oauth2_config):
@@ -538,8 +604,8 @@ def authorize_request(oauth2_config, oauth2_session_data):
     :param
     :return: authorization code, needed for /token call
     """
-    logger.debug(f"oauth_code_request({oauth2_config}, {oauth2_session_data})")
-    headers = {"accept": "application/json", "content-type": "application/json"}
+    logger.debug("oauth_code_request(%s, %s)", oauth2_config, oauth2_session_data)
+    headers = {"accept": "application/json"}
 
     session_token = HTTP_client.session.cookies.get("sessionToken")
 
@@ -585,7 +651,7 @@ def get_nonce(url):
     pattern = re.compile(r'script nonce="(?P<nonce>.*?)" ', re.MULTILINE)
     match = pattern.search(response.text)
     if match:
-        logger.debug(f"Found nonce: {match.group('nonce')}")
+        logger.debug("Found nonce: %s", match.group("nonce"))
         nonce = match.group("nonce")
 
     return nonce
@@ -615,19 +681,34 @@ def get_oauth2_session_data(url):
     return authz_session_data
 
 
-def get_oauth2_configuration(config):
-    """Get authorization server configuration data from Okta instance.
+@functools.lru_cache(maxsize=32)
+def get_authorization_server_metadata(url):
+    """Get the authorization server metadata from an Okta instance.
+
+    The result is cached per org URL for the lifetime of the process, and must not be
+    modified by callers.
 
     :param url: URL of the Okta org
-    :return: dict of conguration values
+    :return: dict of metadata values
     """
-    url = f"{config.okta['org']}/.well-known/oauth-authorization-server"
+    url = f"{url}/.well-known/oauth-authorization-server"
     headers = {"accept": "application/json"}
     response = HTTP_client.get(url, headers=headers)
-    logger.debug(f"Authorization Server info: {response.json()}")
     # TODO: handle errors
-    oauth2_config = response.json()
-    oauth2_config["org"] = config.okta["org"]
+    metadata = response.json()
+    logger.debug("Authorization Server info: %s", metadata)
+    return metadata
+
+
+def get_oauth2_configuration(config):
+    """Get authorization server configuration data from Okta instance.
+
+    :param url: URL of the Okta org
+    :return: dict of conguration values
+    """
+    org = config.okta["org"]
+    oauth2_config = dict(get_authorization_server_metadata(org))
+    oauth2_config["org"] = org
     oauth2_config["client_id"] = get_client_id(config)
     oauth2_config["ln"] = config.okta["username"]
     validate_oauth2_configuration(oauth2_config)
@@ -641,20 +722,10 @@ def validate_oauth2_configuration(oauth2_config):
     Will exit with error if a mandatory config is missing.
     :param oauth2_config: dict of configuration values
     """
-    mandadory_oauth2_config_items = {
-        "authorization_endpoint",
-        "token_endpoint",
-        "grant_types_supported",
-        "response_types_supported",
-        "scopes_supported",
-        "client_id",
-        "org",
-        "ln",
-    }  # the authorization server must have these config elements
-    for item in mandadory_oauth2_config_items:
-        if item not in oauth2_config:
-            logger.error(f"No {item} found in oauth2 configuration.")
-            sys.exit(1)
+    missing_items = _mandatory_oauth2_config_items - oauth2_config.keys()
+    if missing_items:
+        logger.error(f"No {', '.join(sorted(missing_items))} found in oauth2 configuration.")
+        sys.exit(1)
 
     if "authorization_code" not in oauth2_config["grant_types_supported"]:
         logger.error("Authorization code grant not found.")
@@ -680,7 +751,7 @@ def create_authn_cookies(authn_org_url, session_token):
     headers = {"Content-Type": "application/json", "accept": "application/json"}
 
     # Log the request details.
-    logger.debug(f"Requesting session cookies from {url}")
+    logger.debug("Requesting session cookies from %s", url)
 
     # Use the HTTP client to make a POST request.
     response_json = HTTP_client.post(url, json=data, headers=headers, return_json=True)
@@ -698,9 +769,16 @@ def create_authn_cookies(authn_org_url, session_token):
     HTTP_client.add_cookies(cookiejar)  # add cookies
 
 
-def idp_authenticate(config):
-    """Authenticate user to okta."""
-    auth_properties = get_auth_properties(userid=config.okta["username"], url=config.okta["org"])
+def idp_authenticate(config, auth_properties=None):
+    """Authenticate user to okta.
+
+    :param config: Config object
+    :param auth_properties: auth properties for the user, looked up if not provided.
+    """
+    if auth_properties is None:
+        auth_properties = get_auth_properties(
+            userid=config.okta["username"], url=config.okta["org"]
+        )
 
     if "type" not in auth_properties:
         logger.error("Okta auth failed: unknown type.")
@@ -733,25 +811,35 @@ def access_control(config):
 
     :param config: Config object
     """
-    logger.debug(f"access_control({config})")
+    logger.debug("access_control(%s)", config)
 
     oauth2_config = None
     oauth2_session_data = None
 
-    is_oie = oie_enabled(config.okta["org"])
+    org = config.okta["org"]
+
+    # The pipeline and auth properties lookups are independent, so we run them concurrently.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        is_oie_future = executor.submit(oie_enabled, org)
+        auth_properties_future = executor.submit(
+            get_auth_properties, userid=config.okta["username"], url=org
+        )
+        is_oie = is_oie_future.result()
+        auth_properties = auth_properties_future.result()
+
     # We set the oauth2 data (variables and cookies) that will be used at /authorize and during
     # saml2 for chained orgs.
     if is_oie:
         logger.debug("OIE enabled")
         # save some oauth2 config data + create session data, and create authz cookies
         oauth2_config = get_oauth2_configuration(config)
-        oauth2_session_data = get_oauth2_session_data(config.okta["org"])
+        oauth2_session_data = get_oauth2_session_data(org)
         create_authz_cookies(oauth2_config, oauth2_session_data)
         # The flow says to initially call /authorize here, but that doesnt do anything.
         idp_authorize(oauth2_config, oauth2_session_data)
         # We call it later, after we are authenticated.
 
-    idp_authenticate(config)
+    idp_authenticate(config, auth_properties)
 
     if is_oie:
         # call /authorize . Note: we are authenticated.
@@ -784,16 +872,15 @@ def step_up_authenticate(config, state_token):
     :param state_token: The state token
     :return: True if step up authentication was successful; False otherwise
     """
-    auth_properties = get_auth_properties(userid=config.okta["username"], url=config.okta["org"])
+    org = config.okta["org"]
+    auth_properties = get_auth_properties(userid=config.okta["username"], url=org)
     if "type" not in auth_properties or not local_authentication_enabled(auth_properties):
         return False
 
     headers = {"content-type": "application/json", "accept": "application/json"}
     payload = {"stateToken": state_token}
 
-    auth = HTTP_client.post(
-        f"{config.okta['org']}/api/v1/authn", json=payload, headers=headers, return_json=True
-    )
+    auth = HTTP_client.post(f"{org}/api/v1/authn", json=payload, headers=headers, return_json=True)
 
     status = auth.get("status", None)
     if status == "SUCCESS":
@@ -817,8 +904,10 @@ def saml2_authenticate(config, auth_properties):
     saml_request = get_saml_request(auth_properties)
 
     # Create a copy of our configuration, so that we can freely reuse it
-    # without Python's pass-as-reference-value interfering with it.
-    saml2_config = deepcopy(config)
+    # without Python's pass-as-reference-value interfering with it. Only the
+    # okta settings are modified, so that is the only dictionary we copy.
+    saml2_config = copy(config)
+    saml2_config.okta = dict(config.okta)
     saml2_config.okta["org"] = saml_request["base_url"]
     logger.info(f"Authentication is being redirected to {saml2_config.okta['org']}.")
 
@@ -839,13 +928,13 @@ def oie_enabled(url):
     """
     Determine if OIE is enabled.
 
+    The pipeline metadata is cached by get_auth_pipeline, so repeated checks for the
+    same org do not call Okta again.
+
     :pamam url: okta org url
     :return: True if OIE is enabled, False otherwise
     """
-    if get_auth_pipeline(url) == "idx":  # oie
-        return True
-    else:
-        return False
+    return get_auth_pipeline(url) == "idx"  # oie
 
 
 def local_authenticate(config):
@@ -854,15 +943,15 @@ def local_authenticate(config):
     :param config: Config object
     :return: authn token
     """
-    session_token = None
+    org = config.okta["org"]
     headers = {"content-type": "application/json", "accept": "application/json"}
     payload = {"username": config.okta["username"], "password": config.okta["password"]}
 
-    logger.debug(f"Authenticate user to {config.okta['org']}/api/v1/authn")
-    logger.debug(f"Sending {headers}, {payload} to {config.okta['org']}/api/vi/authn")
+    logger.debug("Authenticate user to %s/api/v1/authn", org)
+    logger.debug("Sending %s, %s to %s/api/vi/authn", headers, payload, org)
 
     primary_auth = HTTP_client.post(
-        f"{config.okta['org']}/api/v1/authn",
+        f"{org}/api/v1/authn",
         json=payload,
         headers=headers,
         return_json=True,
@@ -872,9 +961,11 @@ def local_authenticate(config):
         api_error_code_parser(primary_auth["errorCode"])
         sys.exit(1)
 
-    while session_token is None:
-        session_token = get_session_token(config, primary_auth, headers)
-    logger.info(f"User has been successfully authenticated to {config.okta['org']}.")
+    session_token = get_session_token(config, primary_auth, headers)
+    if session_token is None:
+        logger.error(f"Okta auth failed: no session token received from {org}.")
+        sys.exit(1)
+    logger.info(f"User has been successfully authenticated to {org}.")
     return session_token
 
 
@@ -908,98 +999,183 @@ def is_saml2_authentication(auth_properties):
     return False
 
 
+def get_raw_html(html):
+    """Get the raw bytes of an HTML document, for scanning with bytes patterns.
+
+    :param html: Bytes or string with HTML document.
+    :return: bytes
+    """
+    if isinstance(html, bytes):
+        return html
+    return html.encode("utf-8")
+
+
+def parse_tag_attributes(tag):
+    """Parse the quoted attributes of a single opening tag.
+
+    :param tag: Bytes with the opening tag.
+    :return: dict of lowercase attribute names, and their raw values.
+    """
+    return {
+        match.group(1).lower(): match.group(2) if match.group(2) is not None else match.group(3)
+        for match in _tag_attribute_pattern.finditer(tag.decode("utf-8", "replace"))
+    }
+
+
+def scan_saml_form(html, saml_field):
+    """Scan an HTML document for all the fields of a SAML form in a single pass.
+
+    :param html: Bytes with HTML document.
+    :param saml_field: Name of the input with the SAML document.
+    :return: tuple with the SAML document, the form POST URL, and the relay state. Fields
+        that are not found are None.
+    """
+    fields = {("form", "appForm"): None, ("input", saml_field): None, ("input", "RelayState"): None}
+    for tag in _form_field_tag_pattern.finditer(html):
+        if tag.group(1) is None:
+            continue
+        name = tag.group(1).lower().decode("ascii")
+        match_attr, attr = ("id", "action") if name == "form" else ("name", "value")
+        attrs = parse_tag_attributes(tag.group())
+        key = (name, attrs.get(match_attr))
+        if key in fields and fields[key] is None and attr in attrs:
+            fields[key] = unescape(attrs[attr])
+            if None not in fields.values():
+                break
+    return (
+        fields[("input", saml_field)],
+        fields[("form", "appForm")],
+        fields[("input", "RelayState")],
+    )
+
+
+def get_html_tree(html):
+    """Parse an HTML document with lxml, for XPath queries.
+
+    :param html: Bytes or string with HTML document.
+    :return: lxml document, or None if the document is empty.
+    """
+    # The raw bytes carry no reliable charset declaration, and lxml would otherwise read them
+    # as Latin-1. Okta pages, and strings encoded by get_raw_html(), are UTF-8.
+    parser = lxml.html.HTMLParser(encoding="utf-8")
+    try:
+        return lxml.html.document_fromstring(get_raw_html(html), parser=parser)
+    except etree.ParserError:
+        return None
+
+
+def find_tag_attribute(tree, xpath, **variables):
+    """Run a compiled XPath query for an attribute against a parsed document.
+
+    :param tree: lxml document, or None.
+    :param xpath: Compiled XPath that selects attribute values.
+    :param variables: Values for the XPath variables.
+    :return: first attribute value as a string, or None if the tag is not found.
+    """
+    if tree is None:
+        return None
+    values = xpath(tree, **variables)
+    if values:
+        return str(values[0])
+    return None
+
+
+def extract_saml_form(html, saml_field="SAMLResponse", fields=("saml", "post_url", "relay_state")):
+    """Parse html, and extract the fields of a SAML form at once.
+
+    The fields are scanned for in a single pass. If any of the requested fields cannot be read
+    that way, the document is parsed once for all of the remaining ones.
+
+    :param html: Bytes or string with HTML document.
+    :param saml_field: Name of the input with the SAML document, SAMLResponse or SAMLRequest.
+    :param fields: Fields the caller needs, any of "saml", "post_url", and "relay_state".
+    :return: tuple with the base64 encoded SAML document, the form POST URL, and the relay
+        state. Fields that are not found are None.
+    """
+    saml_base64, post_url, relay_state = scan_saml_form(get_raw_html(html), saml_field)
+
+    missing = {
+        "saml": saml_base64 is None,
+        "post_url": post_url is None,
+        "relay_state": relay_state is None,
+    }
+    if any(missing[field] for field in fields):
+        tree = get_html_tree(html)
+        if missing["saml"] and "saml" in fields:
+            saml_base64 = find_tag_attribute(tree, _input_value_xpath, name=saml_field)
+        if missing["post_url"] and "post_url" in fields:
+            post_url = find_tag_attribute(tree, _form_action_xpath, id="appForm")
+        if missing["relay_state"] and "relay_state" in fields:
+            relay_state = find_tag_attribute(tree, _input_value_xpath, name="RelayState")
+
+    if post_url is not None:
+        logger.debug("Found POST URL: %s", post_url)
+    return saml_base64, post_url, relay_state
+
+
 def extract_saml_response(html, raw=False):
     """Parse html, and extract a SAML document.
 
-    :param html: String with HTML document.
+    :param html: Bytes or string with HTML document.
     :param raw: Boolean that determines whether or not the response should be decoded.
     :return: XML Document, or None
     """
-    soup = BeautifulSoup(html, "html.parser")
-    xml = None
-    saml_base64 = None
-    retval = None
-
-    elem = soup.find("input", attrs={"name": "SAMLResponse"})
-    if type(elem) is bs4.element.Tag:
-        saml_base64 = str(elem.get("value"))
-        xml = codecs.decode(saml_base64.encode("ascii"), "base64").decode("utf-8")
+    saml_base64 = extract_saml_form(html, "SAMLResponse", fields=("saml",))[0]
 
-        retval = xml
-        if raw:
-            retval = saml_base64
-    return retval
+    # The caller may only want the encoded document, so skip decoding it.
+    if raw or saml_base64 is None:
+        return saml_base64
+    return base64.b64decode(saml_base64).decode("utf-8")
 
 
 def extract_saml_request(html, raw=False):
     """Parse html, and extract a SAML document.
 
-    :param html: String with HTML document.
+    :param html: Bytes or string with HTML document.
     :param raw: Boolean that determines whether or not the response should be decoded.
     :return: XML Document, or None
     """
-    soup = BeautifulSoup(html, "html.parser")
-    xml = None
-    saml_base64 = None
-    retval = None
+    saml_base64 = extract_saml_form(html, "SAMLRequest", fields=("saml",))[0]
 
-    elem = soup.find("input", attrs={"name": "SAMLRequest"})
-    if type(elem) is bs4.element.Tag:
-        saml_base64 = str(elem.get("value"))
-        xml = codecs.decode(saml_base64.encode("ascii"), "base64").decode("utf-8")
-
-        retval = xml
-        if raw:
-            retval = saml_base64
-    return retval
+    # The caller may only want the encoded document, so skip decoding it.
+    if raw or saml_base64 is None:
+        return saml_base64
+    return base64.b64decode(saml_base64).decode("utf-8")
 
 
 def extract_form_post_url(html):
     """Parse html, and extract a Form Action POST URL.
 
-    :param html: String with HTML document.
+    :param html: Bytes or string with HTML document.
     :return: URL string, or None
     """
-    soup = BeautifulSoup(html, "html.parser")
-    post_url = None
-    elem = soup.find("form", attrs={"id": "appForm"})
-    if type(elem) is bs4.element.Tag:
-        post_url = str(elem.get("action"))
-        logger.debug(f"Found POST URL: {post_url}")
-    return post_url
+    return extract_saml_form(html, fields=("post_url",))[1]
 
 
 def extract_saml_relaystate(html):
     """Parse html, and extract SAML relay state from a form.
 
-    :param html: String with HTML document.
+    :param html: Bytes or string with HTML document.
     :return: relay state value, or None
     """
-    soup = BeautifulSoup(html, "html.parser")
-    relay_state = None
-
-    elem = soup.find("input", attrs={"name": "RelayState"})
-    if type(elem) is bs4.element.Tag:
-        relay_state = str(elem.get("value"))
-    return relay_state
+    return extract_saml_form(html, fields=("relay_state",))[2]
 
 
 def extract_state_token(html):
     """Parse an HTML document, and extract a state token.
 
-    :param html: String with HTML document
+    :param html: Bytes or string with HTML document.
     :return: string with state token, or None
     """
-    soup = BeautifulSoup(html, "html.parser")
     state_token = None
-    pattern = re.compile(r"var stateToken = '(?P<stateToken>.*)';", re.MULTILINE)
 
-    script = soup.find("script", string=pattern)
-    if type(script) is bs4.element.Tag:
-        match = pattern.search(script.text)
-        if match:
-            encoded_token = match.group("stateToken")
-            state_token = codecs.decode(encoded_token, "unicode-escape")
+    # The token lives in an inline script, so the raw document can be searched directly.
+    match = _state_token_pattern.search(get_raw_html(html))
+    if match:
+        state_token = match.group("stateToken").decode("utf-8", "replace")
+        # Most tokens have no escape sequences, and need no further decoding.
+        if "\\" in state_token:
+            state_token = codecs.decode(state_token, "unicode-escape")
 
     return state_token
 
@@ -1026,7 +1202,10 @@ def mfa_provider_type(
 
     """
     mfa_verify = dict()
-    factor_type = selected_factor.get("_embedded", {}).get("factor", {}).get("factorType", None)
+    try:
+        factor_type = selected_factor["_embedded"]["factor"]["factorType"]
+    except (KeyError, TypeError):
+        factor_type = None
 
     if mfa_provider == "DUO":
         mfa_verify = duo.authenticate(selected_factor)
@@ -1057,27 +1236,37 @@ def mfa_provider_type(
     return mfa_verify["sessionToken"]
 
 
-def mfa_index(preset_mfa, available_mfas, mfa_options):
+def mfa_index(preset_mfa, mfa_options):
     """Get mfa index in request.
 
     :param preset_mfa: preset mfa from settings
-    :param available_mfas: available mfa ids
     :param mfa_options: available mfas
     """
     indices = []
-    # Gets the index number from each preset MFA in the list of avaliable ones.
+    available_mfas = []
+    # Gets the index number from each preset MFA in the list of avaliable ones. The MFA ids
+    # are built while searching, so a full id match stops before the remaining ones are built.
     if preset_mfa:
-        logger.debug(f"Get mfa from {available_mfas}.")
-        indices = [i for i, elem in enumerate(available_mfas) if preset_mfa in elem]
+        logger.debug("Get mfa %s from %s options.", preset_mfa, len(mfa_options))
+        for i, option in enumerate(mfa_options):
+            mfa_id = f"{option['provider']}_{option['factorType']}_{option['id']}"
+            available_mfas.append(mfa_id)
+            if mfa_id == preset_mfa:
+                # A full MFA id is unambiguous, even if it is a substring of another one.
+                indices = [i]
+                break
+            if preset_mfa in mfa_id:
+                indices.append(i)
 
     index = None
     if len(indices) == 0:
-        logger.debug(f"No matches with {preset_mfa}, going to get user input")
+        logger.debug("No matches with %s, going to get user input", preset_mfa)
         index = user.select_preferred_mfa_index(mfa_options)
     elif len(indices) == 1:
-        logger.debug(f"One match: {preset_mfa} in {indices}")
+        logger.debug("One match: %s in %s", preset_mfa, indices)
         index = indices[0]
     else:
+        # Multiple matches mean the search ran to the end, and every id was built.
         logger.error(
             f"{preset_mfa} is not unique in {available_mfas}. Please check your configuration."
         )
@@ -1103,11 +1292,10 @@ def mfa_challenge(config, headers, primary_auth):
 
     preset_mfa = config.okta["mfa"]
 
-    available_mfas = [f"{d['provider']}_{d['factorType']}_{d['id']}" for d in mfa_options]
-    index = mfa_index(preset_mfa, available_mfas, mfa_options)
+    index = mfa_index(preset_mfa, mfa_options)
 
     selected_mfa_option = mfa_options[index]
-    logger.debug(f"Selected MFA is [{selected_mfa_option}]")
+    logger.debug("Selected MFA is [%s]", selected_mfa_option)
 
     mfa_challenge_url = selected_mfa_option["_links"]["verify"]["href"]
 
@@ -1123,7 +1311,7 @@ def mfa_challenge(config, headers, primary_auth):
     )
 
     mfa_provider = selected_factor["_embedded"]["factor"]["provider"]
-    logger.debug(f"MFA Challenge URL: [{mfa_challenge_url}] headers: {headers}")
+    logger.debug("MFA Challenge URL: [%s] headers: %s", mfa_challenge_url, headers)
 
     mfa_session_token = mfa_provider_type(
         config,
@@ -1136,7 +1324,7 @@ def mfa_challenge(config, headers, primary_auth):
         payload,
     )
 
-    logger.debug(f"MFA Session Token: [{mfa_session_token}]")
+    logger.debug("MFA Session Token: [%s]", mfa_session_token)
     return mfa_session_token
 
 
@@ -1152,7 +1340,7 @@ def totp_approval(config, selected_mfa_option, headers, mfa_challenge_url, paylo
     :return: payload data
 
     """
-    logger.debug(f"User MFA options selected: [{selected_mfa_option['factorType']}]")
+    logger.debug("User MFA options selected: [%s]", selected_mfa_option["factorType"])
     if config.okta["mfa_response"] is None:
         logger.debug("Getting verification code from user.")
         if selected_mfa_option["factorType"] == "question":
@@ -1176,7 +1364,7 @@ def totp_approval(config, selected_mfa_option, headers, mfa_challenge_url, paylo
 
     if "sessionToken" in mfa_verify:
         user.add_sensitive_value_to_be_masked(mfa_verify["sessionToken"])
-    logger.debug(f"mfa_verify [{json.dumps(mfa_verify)}]")
+    logger.debug("mfa_verify [%s]", mfa_verify)
 
     # Clear out any MFA response since it is no longer valid
     config.okta["mfa_response"] = None
@@ -1184,6 +1372,24 @@ def totp_approval(config, selected_mfa_option, headers, mfa_challenge_url, paylo
     return mfa_verify
 
 
+def display_number_challenge(response):
+    """Show the Number Challenge answer from a push verification response, if there is one.
+
+    :param response: MFA verification response
+    :return: True if a Number Challenge was displayed, False otherwise.
+    """
+    # If a Number Challenge response exists, retrieve it from this deeply nested path,
+    # otherwise set to None.
+    try:
+        answer = response["_embedded"]["factor"]["_embedded"]["challenge"]["correctAnswer"]
+    except (KeyError, TypeError):
+        answer = None
+    if answer:
+        user.print(f"Number Challenge response is {answer}")
+        return True
+    return False
+
+
 def push_approval(mfa_challenge_url, payload):
     """Handle push approval from the user.
 
@@ -1192,17 +1398,17 @@ def push_approval(mfa_challenge_url, payload):
     :return: Session Token if succeeded or terminates if user wait goes 5 min
 
     """
-    logger.debug(f"Push approval with challenge_url:{mfa_challenge_url}")
+    logger.debug("Push approval with challenge_url:%s", mfa_challenge_url)
 
     user.print("Waiting for an approval from the device...")
-    status = "MFA_CHALLENGE"
-    result = "WAITING"
-    response = {}
     challenge_displayed = False
+    # Poll quickly at first so an approval is picked up right away, and back off while the
+    # user reaches for the device.
+    interval = 0.25
 
     headers = {"content-type": "application/json", "accept": "application/json"}
 
-    while status == "MFA_CHALLENGE" and result == "WAITING":
+    while True:
         response = HTTP_client.post(
             mfa_challenge_url, json=payload, headers=headers, return_json=True
         )
@@ -1210,29 +1416,23 @@ def push_approval(mfa_challenge_url, payload):
         if "sessionToken" in response:
             user.add_sensitive_value_to_be_masked(response["sessionToken"])
 
-        logger.debug(f"MFA Response:\n{json.dumps(response)}")
+        logger.debug("MFA Response:\n%s", response)
         # Retrieve these values from the object, and set a sensible default if they do not
         # exist.
         status = response.get("status", "UNKNOWN")
         result = response.get("factorResult", "UNKNOWN")
 
+        # The Number Challenge only needs to be looked up until it has been shown once.
+        challenge_displayed = challenge_displayed or display_number_challenge(response)
+
         # The docs at https://developer.okta.com/docs/reference/api/authn/#verify-push-factor
         # state that the call will return a factorResult in [ SUCCESS, REJECTED, TIMEOUT,
         # WAITING]. However, on success, SUCCESS is not set and we have to rely on the
-        # response["status"] instead
-        answer = (
-            response.get("_embedded", {})
-            .get("factor", {})
-            .get("_embedded", {})
-            .get("challenge", {})
-            .get("correctAnswer", None)
-        )
-        if answer and not challenge_displayed:
-            # If a Number Challenge response exists, retrieve it from this deeply nested path,
-            # otherwise set to None.
-            user.print(f"Number Challenge response is {answer}")
-            challenge_displayed = True
-        time.sleep(1)
+        # response["status"] instead. Stop on the first terminal answer, without sleeping.
+        if status != "MFA_CHALLENGE" or result != "WAITING":
+            break
+        time.sleep(interval)
+        interval = min(2.0, interval * 1.5)
 
     if status == "SUCCESS" and "sessionToken" in response:
         # noop, we will return the variable later
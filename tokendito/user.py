@@ -130,6 +130,14 @@ class MaskLoggerSecret(logging.Filter):
 
     def filter(self, record):
         """Apply filter on logger messages."""
+        # Merge lazily formatted arguments into the message, so that they are masked too.
+        # Filters only run for enabled levels, so this does not format discarded records.
+        # A format mismatch is left for the handler to report, as it would be without masking.
+        if record.args:
+            try:
+                record.msg, record.args = record.getMessage(), None
+            except (TypeError, ValueError):
+                pass
         for secret in mask_items:
             if not isinstance(secret, str):
                 secret = str(secret)
@@ -625,7 +633,7 @@ def get_account_aliases(saml_xml, saml_response_string):
     :param saml_response_string response from Okta with saml data:
     :return: mapping table of account ids to their aliases
     """
-    soup = BeautifulSoup(saml_response_string, "html.parser")
+    soup = BeautifulSoup(saml_response_string, "lxml")
     form = soup.find("form")
     action = form.get("action")  # type: ignore (bs4 does not have PEP 561 support)
     url = str(action)
@@ -644,7 +652,7 @@ def get_account_aliases(saml_xml, saml_response_string):
         logger.debug(json.dumps(aws_response.text))
         return None
 
-    soup = BeautifulSoup(aws_response.text, "html.parser")
+    soup = BeautifulSoup(aws_response.text, "lxml")
     account_names = soup.find_all(text=re.compile("Account:"))
     alias_table = {str(i.split(" ")[-1]).strip("()"): i.split(" ")[1] for i in account_names}
 